@@ -6,10 +6,19 @@ are plain strings in the CBOR (base64url and string-encoded CID respectively).
 
 Compressed file format
 ======================
-The compressed output is a CBOR encoded array (not valid DAG-CBOR, since it
-uses custom semantic tags):
+The compressed output is a sequence of frames, each a LEB128 varint byte
+length followed by one CBOR item (not valid DAG-CBOR, since it uses custom
+semantic tags):
 
-  [ full_op, diff_1, diff_2, ... ]
+  frame(version) frame(full_op) frame(diff_1) frame(diff_2) ...
+
+Frames let a reader decode and apply one entry at a time (decompress_iter).
+
+- version: The format version, currently FORMAT_VERSION (3). The original
+  format, read as version 0, was a single CBOR array with no version,
+  [ full_op, diff_1, ... ]. Such a blob always starts with an array header
+  byte (0x80-0x9f), never with 0x01, the length of the version frame, so
+  both layouts are still read.
 
 - full_op: The first operation, with semantic tag compression applied.
 
@@ -17,10 +26,17 @@ uses custom semantic tags):
   All indices reference the *previous* operation's uncompressed structure.
   Supported keys:
 
-    "u" -> [[index, value], ...]   updates: replace leaf at index
-    "d" -> [index, ...]            deletes: remove map entry or array element
-    "i" -> [[index, value], ...]   inserts: append to container at index
-    "p" -> [[index, value], ...]   prepends: insert before element at index
+    "u" -> [[index, ...], [value, ...]]  updates: replace leaf at index
+    "d" -> [index, ...]                  deletes: remove map entry or array element
+    "i" -> [[index, value], ...]         inserts: append to container at index
+    "p" -> [[index, value], ...]         prepends: insert before element at index
+
+  Updates are stored as two parallel arrays (indices, then values) so the
+  whole diff pays for one array header per side rather than one per pair.
+  The index array is delta-encoded: the first entry is absolute and each
+  later entry is the gap from the one before, so clustered updates fit in
+  single-byte CBOR integers. Version 0 stored updates as
+  [[index, value], ...].
 
   For map inserts, value is [key_string, value_structure].
   For array inserts/prepends, value is the element itself.
@@ -45,11 +61,52 @@ Field name tags (single-byte, 0xca-0xd3) — used as map keys, wrapping null:
 """
 
 import base64
-import copy
+from bisect import bisect_left, bisect_right
+import functools
+import io
+from itertools import accumulate
 import cbor2
 import dag_cbor
 from multiformats import multibase
 
+try:
+    import pybase64           # SIMD base64 with the same API as the stdlib module
+except ImportError:
+    import base64 as pybase64
+
+try:
+    import based58            # native base58 codec (Rust)
+except ImportError:
+    based58 = None
+
+try:
+    import numpy as np
+    from numba import njit    # optional: compiled LCS kernel for long lists
+except ImportError:
+    njit = None
+
+# did:key identifiers are always base58btc ("z" prefix): resolve the codec once
+# so the hot path skips multibase's per-call prefix dispatch, and use based58's
+# native codec for the body when it is installed. CIDs are base32lower ("b"
+# prefix) and go through the stdlib's C base32 codec instead.
+_B58 = multibase.get("base58btc")
+
+if based58 is not None:
+    def _b58decode(s):
+        return based58.b58decode(s.encode("ascii"))
+
+    def _b58encode(raw):
+        return based58.b58encode(raw).decode("ascii")
+else:
+    def _b58decode(s):
+        return bytes(_B58.raw_decoder(s))
+
+    _b58encode = _B58.raw_encoder
+
+# A CID string's 58-char base32 body holds 290 bits for 288 bits of CID, so it
+# only round-trips if the final character has its two low bits clear.
+_B32_CANONICAL_LAST = frozenset("aeimquy4")
+
 # Semantic tag numbers: 6-9 are single-byte CBOR tags (0xc6-0xc9) that cbor2
 # passes through without semantic interpretation. DAG-CBOR only allows tag 42,
 # so any other tag is unambiguously a compression marker.
@@ -58,6 +115,9 @@ TAG_CID = 7
 TAG_DID_KEY = 8
 TAG_AT_URI = 9
 
+# Payload of the blob's first frame; see the module docstring.
+FORMAT_VERSION = 3
+
 # Field name compression using semantic tags 10-19 (single-byte, 0xca-0xd3).
 # tag(10+i, null) replaces a string map key, using the same extension mechanism
 # as value tags so the only assumption is "non-42 tags are ours".
@@ -94,132 +154,408 @@ class FieldNameTag:
         return isinstance(other, FieldNameTag) and self.num == other.num
 
 
-def _cbor_dumps(obj):
-    def default(encoder, value):
-        if isinstance(value, FieldNameTag):
-            encoder.encode(cbor2.CBORTag(value.num, None))
-        else:
-            raise cbor2.CBOREncodeTypeError(f"cannot encode {type(value)}")
-    return cbor2.dumps(obj, default=default)
+class ValueTag:
+    """Slotted (tag, value) pair for compressed values, encoded as tag(N, value).
+
+    Lighter than cbor2.CBORTag for the many tagged values built while
+    compressing; the decoder still produces CBORTag.
+    """
+    __slots__ = ("tag", "value")
+
+    def __init__(self, tag, value):
+        self.tag = tag
+        self.value = value
+
+
+def _cbor_default(encoder, value):
+    if isinstance(value, ValueTag):
+        encoder.encode_length(6, value.tag)   # major type 6: semantic tag
+        encoder.encode(value.value)
+    elif isinstance(value, FieldNameTag):
+        # Written straight to the stream as tag(N, null), without building a
+        # CBORTag just to hand it back to the encoder.
+        encoder.encode_length(6, value.num)   # major type 6: semantic tag
+        encoder.write(b"\xf6")                # null
+    else:
+        raise cbor2.CBOREncodeTypeError(f"cannot encode {type(value)}")
 
 
-def _cbor_loads(data):
-    def tag_hook(decoder, tag):
-        if tag.tag in TAG_TO_FIELD:
-            return FieldNameTag(tag.tag)
-        return tag
-    return cbor2.loads(data, tag_hook=tag_hook)
+def _cbor_dumps(obj, _dumps=cbor2.dumps):
+    # The blob is not DAG-CBOR (it carries tags 6-19), so key sorting and
+    # shared-reference tracking are spelled out as off rather than left to
+    # cbor2's defaults.
+    return _dumps(obj, default=_cbor_default, canonical=False, value_sharing=False)
+
+
+def _tag_hook(decoder, tag):
+    if tag.tag in TAG_TO_FIELD:
+        return FieldNameTag(tag.tag)
+    return tag
+
+
+def _cbor_loads(data, _loads=cbor2.loads):
+    return _loads(data, tag_hook=_tag_hook)
+
+
+# Bound once for the per-node type checks in the walkers.
+_CBORTag = cbor2.CBORTag
 
 # --- Semantic tag compression ---
 
-def sem_compress_value(val):
+# Rotation keys and CIDs repeat heavily across an audit log, so their codecs are
+# memoized in both directions: string -> tag when compressing, payload -> string
+# when decompressing. The cached ValueTag objects are shared between callers and
+# must be treated as immutable. Sigs are unique per op and at:// URIs only lose
+# a prefix, so neither is worth a cache slot.
+_CODEC_CACHE_SIZE = 1 << 16
+
+@functools.lru_cache(maxsize=_CODEC_CACHE_SIZE)
+def _compress_did_key(val):
+    return ValueTag(TAG_DID_KEY, _b58decode(val[9:]))
+
+
+@functools.lru_cache(maxsize=_CODEC_CACHE_SIZE)
+def _compress_cid(val):
+    """Tag for a bafyrei... CID string, or None if it is not valid base32."""
+    try:
+        return ValueTag(TAG_CID, base64.b32decode(val[1:].upper() + "======"))
+    except ValueError:
+        return None
+
+
+def sem_compress_value(val, _Tag=ValueTag, _b64decode=pybase64.urlsafe_b64decode,
+                       _did_key=_compress_did_key, _cid=_compress_cid):
     """Compress a single string value using semantic tags if applicable."""
-    if not isinstance(val, str):
+    if not isinstance(val, str) or not val:
         return val
-    if val.startswith("did:key:"):
-        return cbor2.CBORTag(TAG_DID_KEY, bytes(multibase.decode(val[8:])))
-    if val.startswith("at://"):
-        return cbor2.CBORTag(TAG_AT_URI, val[5:])
-    if val.startswith("bafyrei") and len(val) == 59:
-        return cbor2.CBORTag(TAG_CID, bytes(multibase.decode(val)))
-    if len(val) == 86:
+    # Dispatch on first character and length so most strings only pay for a
+    # couple of comparisons; prefix checks run in the original priority order.
+    n = len(val)
+    c = val[0]
+    if n < 40 and c not in "dab":
+        return val      # map keys and other short strings: no pattern can match
+    if c == "d":
+        if val.startswith("did:key:z"):
+            return _did_key(val)
+    elif c == "a":
+        if val.startswith("at://"):
+            return _Tag(TAG_AT_URI, val[5:])
+    elif c == "b":
+        if (n == 59 and val.startswith("bafyrei") and val.islower()
+                and val[-1] in _B32_CANONICAL_LAST):
+            tag = _cid(val)
+            if tag is not None:
+                return tag
+    if n == 86:
         try:
-            raw = base64.urlsafe_b64decode(val + "==")
+            raw = _b64decode(val + "==")
             if len(raw) == 64:
-                return cbor2.CBORTag(TAG_SIG, raw)
+                return _Tag(TAG_SIG, raw)
         except Exception:
             pass
     return val
 
 
+@functools.lru_cache(maxsize=_CODEC_CACHE_SIZE)
+def _expand_did_key(raw):
+    return "did:key:z" + _b58encode(raw)
+
+
+@functools.lru_cache(maxsize=_CODEC_CACHE_SIZE)
+def _expand_cid(raw):
+    return "b" + base64.b32encode(raw).decode("ascii").rstrip("=").lower()
+
+
 def sem_decompress_value(val):
     """Expand a single tagged value back to its original string form."""
-    if not isinstance(val, cbor2.CBORTag):
+    if not isinstance(val, (_CBORTag, ValueTag)):
         return val
     if val.tag == TAG_SIG:
-        return base64.urlsafe_b64encode(val.value).rstrip(b"=").decode()
+        return pybase64.urlsafe_b64encode(val.value).rstrip(b"=").decode()
     if val.tag == TAG_CID:
-        return multibase.encode(val.value, "base32")
+        return _expand_cid(val.value)
     if val.tag == TAG_DID_KEY:
-        return "did:key:" + multibase.encode(val.value, "base58btc")
+        return _expand_did_key(val.value)
     if val.tag == TAG_AT_URI:
         return "at://" + val.value
     return val
 
 
 def sem_compress(obj):
-    """Recursively apply semantic tag compression to a structure."""
-    if isinstance(obj, dict):
-        return {(FieldNameTag(FIELD_TO_TAG[k]) if k in FIELD_TO_TAG else k): sem_compress(v)
-                for k, v in obj.items()}
-    if isinstance(obj, list):
-        return [sem_compress(item) for item in obj]
-    return sem_compress_value(obj)
+    """Apply semantic tag compression to a structure.
+
+    Walks with an explicit stack rather than recursion: each container is
+    replaced by a fresh one in its parent's slot, and its child containers
+    are pushed to be filled in as they are popped. Scalar children are
+    converted on the spot, so only containers ever go through the stack.
+    """
+    root = [None]
+    stack = [(obj, root, 0)]
+    while stack:
+        node, parent, slot = stack.pop()
+        t = type(node)
+        if t is dict:
+            new = {}
+            for k, v in node.items():
+                key = FieldNameTag(FIELD_TO_TAG[k]) if k in FIELD_TO_TAG else k
+                t = type(v)
+                if t is dict or t is list:
+                    new[key] = None
+                    stack.append((v, new, key))
+                else:
+                    new[key] = sem_compress_value(v)
+        elif t is list:
+            new = [None] * len(node)
+            for i, item in enumerate(node):
+                t = type(item)
+                if t is dict or t is list:
+                    stack.append((item, new, i))
+                else:
+                    new[i] = sem_compress_value(item)
+        else:
+            new = sem_compress_value(node)
+        parent[slot] = new
+    return root[0]
 
 
 def sem_decompress(obj):
-    """Recursively expand semantic tags in a structure."""
-    if isinstance(obj, cbor2.CBORTag):
-        return sem_decompress_value(obj)
-    if isinstance(obj, dict):
-        return {(TAG_TO_FIELD[k.num] if isinstance(k, FieldNameTag) else k): sem_decompress(v)
-                for k, v in obj.items()}
-    if isinstance(obj, list):
-        return [sem_decompress(item) for item in obj]
-    return obj
+    """Expand semantic tags in a structure (iteratively, as sem_compress)."""
+    root = [None]
+    stack = [(obj, root, 0)]
+    while stack:
+        node, parent, slot = stack.pop()
+        t = type(node)
+        if t is dict:
+            new = {}
+            for k, v in node.items():
+                key = TAG_TO_FIELD[k.num] if isinstance(k, FieldNameTag) else k
+                t = type(v)
+                if t is dict or t is list:
+                    new[key] = None
+                    stack.append((v, new, key))
+                elif t is ValueTag or t is _CBORTag:
+                    new[key] = sem_decompress_value(v)
+                else:
+                    new[key] = v
+        elif t is list:
+            new = [None] * len(node)
+            for i, item in enumerate(node):
+                t = type(item)
+                if t is dict or t is list:
+                    stack.append((item, new, i))
+                elif t is ValueTag or t is _CBORTag:
+                    new[i] = sem_decompress_value(item)
+                else:
+                    new[i] = item
+        elif t is ValueTag or t is _CBORTag:
+            new = sem_decompress_value(node)
+        else:
+            new = node
+        parent[slot] = new
+    return root[0]
 
 
 # --- Indexing helpers ---
 
+# Stack markers for the iterative walkers: _NO_KEY tags a node that is not a
+# map value, _EXIT closes a container once all of its children are done.
+_NO_KEY = object()
+_EXIT = object()
+
+# Placeholder stored by build_index at each map entry marker position.
+MAP_ENTRY = object()
+
 def build_index(obj):
     """
     Assign a flat incrementing index to every CBOR entity in the structure.
-    Returns {index: value} for all entities except map entry groupings.
+    Returns a list where items[index] is the entity at that index; map entry
+    groupings hold the MAP_ENTRY placeholder.
     """
-    items = {}
-    counter = [0]
-
-    def _next():
-        idx = counter[0]
-        counter[0] += 1
-        return idx
-
-    def _walk(obj):
-        items[_next()] = obj
-        if isinstance(obj, dict):
-            for key, value in obj.items():
-                _next()            # map entry
-                items[_next()] = key   # field name
-                _walk(value)       # field value
-        elif isinstance(obj, list):
-            for item in obj:
-                _walk(item)        # array element
-
-    _walk(obj)
+    items = []
+    append = items.append
+    # (node, field name or _NO_KEY), popped in pre-order
+    stack = [(obj, _NO_KEY)]
+    while stack:
+        node, key = stack.pop()
+        if key is not _NO_KEY:
+            append(MAP_ENTRY)          # map entry
+            append(key)                # field name
+        append(node)
+        t = type(node)
+        if t is dict:
+            stack.extend((v, k) for k, v in reversed(node.items()))
+        elif t is list:
+            stack.extend((item, _NO_KEY) for item in reversed(node))
     return items
 
 
 def count_indices(obj):
     """Count total flat indices consumed by an object and its subtree."""
-    if isinstance(obj, dict):
-        total = 1  # dict itself
-        for k, v in obj.items():
-            total += 2  # entry marker + key
-            total += count_indices(v)
-        return total
-    elif isinstance(obj, list):
-        total = 1  # list itself
-        for item in obj:
-            total += count_indices(item)
-        return total
-    else:
-        return 1  # scalar
+    total = 0
+    stack = [obj]
+    while stack:
+        node = stack.pop()
+        total += 1                       # the node itself
+        t = type(node)
+        if t is dict:
+            total += 2 * len(node)       # entry marker + key per entry
+            stack.extend(node.values())
+        elif t is list:
+            stack.extend(node)
+    return total
+
+
+def size_map(root):
+    """Map id(container) -> count_indices(container) for every container in root.
+
+    One pass over the tree: containers are collected in pre-order and sized
+    in reverse, so each child is sized before its parent. Scalars are left
+    out; they always take exactly one index.
+    """
+    order = []
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        t = type(node)
+        if t is dict:
+            order.append(node)
+            stack.extend(node.values())
+        elif t is list:
+            order.append(node)
+            stack.extend(node)
+    sizes = {}
+    get = sizes.get
+    for node in reversed(order):
+        if type(node) is dict:
+            sizes[id(node)] = 1 + sum(2 + get(id(v), 1) for v in node.values())
+        else:
+            sizes[id(node)] = 1 + sum(get(id(item), 1) for item in node)
+    return sizes
 
 
 # --- Structural diff ---
 
 def compute_lcs(old_list, new_list):
-    """Compute LCS of two lists by value equality. Returns [(old_pos, new_pos), ...]."""
+    """Compute LCS of two lists by value equality. Returns [(old_pos, new_pos), ...].
+
+    Uses Hunt-Szymanski: each old element's matching new positions are fed,
+    highest first, into a patience-sort tails array, so the cost grows with
+    the number of matches rather than with len(old) * len(new). Map and list
+    elements are compared by their DAG-CBOR encoding (see _lcs_key), so every
+    element is hashable; lists that DAG-CBOR cannot encode fall back to the
+    full DP table.
+    """
+    try:
+        old_keys = [_lcs_key(x) for x in old_list]
+        if njit is not None and len(old_list) + len(new_list) >= _NUMBA_MIN_LEN:
+            return _lcs_compiled(old_keys, [_lcs_key(x) for x in new_list])
+        matches = {}
+        for j in range(len(new_list) - 1, -1, -1):
+            matches.setdefault(_lcs_key(new_list[j]), []).append(j)
+        tails = []   # tails[k]: smallest new_pos ending a common run of length k+1
+        links = []   # links[k]: (old_pos, new_pos, link to the previous pair)
+        for i, key in enumerate(old_keys):
+            for j in matches.get(key, ()):
+                k = bisect_left(tails, j)
+                link = (i, j, links[k - 1] if k else None)
+                if k == len(tails):
+                    tails.append(j)
+                    links.append(link)
+                else:
+                    tails[k] = j
+                    links[k] = link
+    except (TypeError, dag_cbor.encoding.CBOREncodingError):
+        return _lcs_table(old_list, new_list)
+    pairs = []
+    link = links[-1] if links else None
+    while link is not None:
+        pairs.append(link[:2])
+        link = link[2]
+    pairs.reverse()
+    return pairs
+
+
+def _lcs_key(item):
+    """Hashable equality key for an LCS element.
+
+    Containers are keyed by their canonical DAG-CBOR bytes, wrapped in a tuple
+    so they can never collide with a bytes scalar; scalars key as themselves.
+    """
+    t = type(item)
+    if t is dict or t is list:
+        return (dag_cbor.encode(item),)
+    return item
+
+
+# Below this many elements in total the compiled kernel's call and conversion
+# overhead outweighs the win; PLC op lists are nearly always far shorter.
+_NUMBA_MIN_LEN = 256
+
+def _lcs_compiled(old_keys, new_keys):
+    """compute_lcs over precomputed keys, via the compiled _hs_kernel.
+
+    Keys are fingerprinted to dense ints so the kernel only sees int64 arrays.
+    """
+    ids = {}
+    a = np.array([ids.setdefault(k, len(ids)) for k in old_keys], dtype=np.int64)
+    b = np.array([ids.setdefault(k, len(ids)) for k in new_keys], dtype=np.int64)
+    return [(int(i), int(j)) for i, j in _hs_kernel(a, b, len(ids))]
+
+
+if njit is not None:
+    @njit(cache=True)
+    def _hs_kernel(a, b, nids):
+        """compute_lcs's Hunt-Szymanski loop over int fingerprint arrays.
+
+        Matches are bucketed CSR-style (start[v]..start[v+1] holds the new
+        positions of id v, ascending) and scanned highest first, exactly as in
+        compute_lcs, so both paths return the same pairs.
+        """
+        n, m = a.size, b.size
+        start = np.zeros(nids + 1, np.int64)
+        for j in range(m):
+            start[b[j] + 1] += 1
+        for v in range(nids):
+            start[v + 1] += start[v]
+        pos = np.empty(m, np.int64)
+        fill = start[:-1].copy()
+        for j in range(m):
+            pos[fill[b[j]]] = j
+            fill[b[j]] += 1
+        r = 0
+        for i in range(n):
+            r += start[a[i] + 1] - start[a[i]]
+        link_i = np.empty(r, np.int64)      # one link per match, as in compute_lcs
+        link_j = np.empty(r, np.int64)
+        link_prev = np.empty(r, np.int64)
+        tails = np.empty(min(n, m) + 1, np.int64)
+        tail_link = np.empty(min(n, m) + 1, np.int64)
+        length = 0
+        r = 0
+        for i in range(n):
+            v = a[i]
+            for p in range(start[v + 1] - 1, start[v] - 1, -1):
+                j = pos[p]
+                k = np.searchsorted(tails[:length], j)   # bisect_left
+                link_i[r] = i
+                link_j[r] = j
+                link_prev[r] = tail_link[k - 1] if k else -1
+                tails[k] = j
+                tail_link[k] = r
+                if k == length:
+                    length += 1
+                r += 1
+        pairs = np.empty((length, 2), np.int64)
+        link = tail_link[length - 1] if length else -1
+        for t in range(length - 1, -1, -1):
+            pairs[t, 0] = link_i[link]
+            pairs[t, 1] = link_j[link]
+            link = link_prev[link]
+        return pairs
+
+
+def _lcs_table(old_list, new_list):
+    """compute_lcs by the full O(n*m) DP table, for elements DAG-CBOR rejects."""
     n, m = len(old_list), len(new_list)
     dp = [[0] * (m + 1) for _ in range(n + 1)]
     for i in range(1, n + 1):
@@ -243,11 +579,37 @@ def compute_lcs(old_list, new_list):
     return pairs
 
 
+def _strict_equal(a, b):
+    """a == b, but with types matching throughout.
+
+    Python equality treats 1, True and 1.0 as the same value, while DAG-CBOR
+    encodes them differently, so a subtree may only be skipped as unchanged
+    if this holds.
+    """
+    t = type(a)
+    if t is not type(b):
+        return False
+    if t is dict:
+        return a.keys() == b.keys() and all(
+            _strict_equal(value, b[key]) for key, value in a.items())
+    if t is list:
+        return len(a) == len(b) and all(map(_strict_equal, a, b))
+    return a == b
+
+
+class _Ctx:
+    """Walk state shared by the nested walkers: the next flat index."""
+    __slots__ = ("idx",)
+
+    def __init__(self):
+        self.idx = 0
+
+
 def compute_diff(old, new):
     """Compute a full structural diff between old and new operations.
 
     Returns (updates, deletes, inserts, prepends) where:
-      updates:  {flat_idx: new_value}
+      updates:  {flat_idx: new_value}, inserted in ascending index order
       deletes:  set of flat_idx
       inserts:  {container_idx: [value, ...]}
       prepends: {element_idx: [value, ...]}
@@ -260,18 +622,19 @@ def compute_diff(old, new):
     deletes = set()
     inserts = {}
     prepends = {}
-    counter = [0]
-
-    def _next():
-        idx = counter[0]
-        counter[0] += 1
-        return idx
-
-    def _advance(obj):
-        counter[0] += count_indices(obj)
+    ctx = _Ctx()
+    sizes = size_map(old)
 
     def _diff(old_obj, new_obj):
-        idx = _next()
+        idx = ctx.idx
+        ctx.idx = idx + 1
+
+        t = type(old_obj)
+        if (t is dict or t is list) and (
+                old_obj is new_obj
+                or (old_obj == new_obj and _strict_equal(old_obj, new_obj))):
+            ctx.idx += sizes.get(id(old_obj), 1) - 1   # unchanged subtree
+            return
 
         if isinstance(old_obj, dict) and isinstance(new_obj, dict):
             old_keys = set(old_obj.keys())
@@ -285,42 +648,38 @@ def compute_diff(old, new):
 
             # Walk old keys in order (DAG-CBOR canonical)
             for key in old_obj:
-                entry_idx = _next()  # entry marker
-                _next()              # key name
+                entry_idx = ctx.idx  # entry marker
+                ctx.idx += 2         # entry marker + key name
 
                 if key not in new_obj:
                     deletes.add(entry_idx)
-                    _advance(old_obj[key])
+                    ctx.idx += sizes.get(id(old_obj[key]), 1)
                 else:
                     _diff(old_obj[key], new_obj[key])
 
         elif isinstance(old_obj, list) and isinstance(new_obj, list):
             lcs_pairs = compute_lcs(old_obj, new_obj)
-            old_matched = {op for op, np in lcs_pairs}
-            new_matched = {np for op, np in lcs_pairs}
+            old_to_new = dict(lcs_pairs)
             new_to_old = {np: op for op, np in lcs_pairs}
+            sorted_new = [np for op, np in lcs_pairs]   # LCS pairs ascend in both
 
             # Record flat indices for old elements
             old_elem_indices = {}
             for i, item in enumerate(old_obj):
-                old_elem_indices[i] = counter[0]
-                if i in old_matched:
-                    matched_new_pos = next(np for op, np in lcs_pairs if op == i)
-                    _diff(item, new_obj[matched_new_pos])
+                old_elem_indices[i] = ctx.idx
+                if i in old_to_new:
+                    _diff(item, new_obj[old_to_new[i]])
                 else:
-                    deletes.add(counter[0])
-                    _advance(item)
+                    deletes.add(ctx.idx)
+                    ctx.idx += sizes.get(id(item), 1)
 
             # Classify new-only elements as insert or prepend
             for j in range(len(new_obj)):
-                if j in new_matched:
+                if j in new_to_old:
                     continue
                 # Find next LCS element after position j in new array
-                next_lcs_new = None
-                for np in sorted(new_matched):
-                    if np > j:
-                        next_lcs_new = np
-                        break
+                k = bisect_right(sorted_new, j)
+                next_lcs_new = sorted_new[k] if k < len(sorted_new) else None
 
                 if next_lcs_new is not None:
                     old_pos = new_to_old[next_lcs_new]
@@ -331,6 +690,7 @@ def compute_diff(old, new):
 
         elif type(old_obj) != type(new_obj):
             updates[idx] = new_obj
+            ctx.idx += sizes.get(id(old_obj), 1) - 1   # skip the replaced subtree
 
         else:
             if old_obj != new_obj:
@@ -340,102 +700,203 @@ def compute_diff(old, new):
     return updates, deletes, inserts, prepends
 
 
+def _cbor_key(kv):
+    """Sort key putting (key, value) items in DAG-CBOR canonical order:
+    by key length, then lexicographic."""
+    return (len(kv[0]), kv[0])
+
+
 def apply_diff(obj, updates, deletes, inserts, prepends):
-    """Apply a full structural diff to a deep copy of obj."""
-    obj = copy.deepcopy(obj)
-    counter = [0]
+    """Apply a full structural diff to obj, returning the new structure.
 
-    def _next():
-        idx = counter[0]
-        counter[0] += 1
-        return idx
+    Only containers whose index span holds an edit are rebuilt; every other
+    subtree is shared with obj by reference, so neither obj nor the result
+    should be mutated afterwards.
+    """
+    # Every index an edit is keyed on, sorted: a container whose span
+    # [idx, idx + size) holds none of them comes through unchanged.
+    edits = sorted({*updates, *deletes, *inserts, *prepends})
+    if not edits:
+        return obj
+    ctx = _Ctx()
+    sizes = size_map(obj)
 
-    def _advance(obj):
-        counter[0] += count_indices(obj)
+    def _walk(obj):
+        idx = ctx.idx
+        size = sizes.get(id(obj), 1)
 
-    def _walk(obj, setter):
-        idx = _next()
+        k = bisect_left(edits, idx)
+        if k == len(edits) or edits[k] >= idx + size:
+            ctx.idx = idx + size                      # untouched subtree
+            return obj
 
         if idx in updates:
-            setter(updates[idx])
-            if not isinstance(obj, (dict, list)):
-                return
+            ctx.idx = idx + size                      # replaced subtree
+            return updates[idx]
+        ctx.idx = idx + 1
 
         if isinstance(obj, dict):
-            keys_to_delete = []
+            new_obj = {}
 
-            for key in list(obj.keys()):
-                entry_idx = _next()  # entry marker
-                _next()              # key name
+            for key, val in obj.items():
+                entry_idx = ctx.idx  # entry marker
+                ctx.idx += 2         # entry marker + key name
 
                 if entry_idx in deletes:
-                    _advance(obj[key])
-                    keys_to_delete.append(key)
+                    ctx.idx += sizes.get(id(val), 1)
                 else:
-                    _walk(obj[key], lambda v, k=key, o=obj: o.__setitem__(k, v))
-
-            for key in keys_to_delete:
-                del obj[key]
+                    new_obj[key] = _walk(val)
 
+            # Deletes keep the remaining keys in order; only appended keys
+            # need a re-sort to DAG-CBOR canonical order.
             if idx in inserts:
                 for key, val in inserts[idx]:
-                    obj[key] = val
-
-            # Re-sort to DAG-CBOR canonical order (by key length, then lexicographic)
-            if keys_to_delete or idx in inserts:
-                sorted_items = sorted(obj.items(), key=lambda kv: (len(kv[0]), kv[0]))
-                obj.clear()
-                for k, v in sorted_items:
-                    obj[k] = v
+                    new_obj[key] = val
+                new_obj = dict(sorted(new_obj.items(), key=_cbor_key))
+            return new_obj
 
         elif isinstance(obj, list):
-            delete_positions = set()
-            prepend_map = {}
+            new_items = []
 
-            for i, item in enumerate(obj):
-                elem_idx = counter[0]
+            for item in obj:
+                elem_idx = ctx.idx
 
                 if elem_idx in deletes:
-                    _advance(item)
-                    delete_positions.add(i)
+                    ctx.idx += sizes.get(id(item), 1)
                 else:
                     if elem_idx in prepends:
-                        prepend_map[i] = prepends[elem_idx]
-                    _walk(item, lambda v, j=i, o=obj: o.__setitem__(j, v))
-
-            new_items = []
-            for i, item in enumerate(obj):
-                if i in prepend_map:
-                    new_items.extend(prepend_map[i])
-                if i not in delete_positions:
-                    new_items.append(item)
+                        new_items.extend(prepends[elem_idx])
+                    new_items.append(_walk(item))
 
             if idx in inserts:
                 new_items.extend(inserts[idx])
+            return new_items
 
-            obj[:] = new_items
+        return obj
 
-    _walk(obj, lambda v: None)
-    return obj
+    return _walk(obj)
 
 
 # --- Legacy update-only functions (kept for reference) ---
 
 def compute_updates(old, new):
-    """Return {index: new_value} for every leaf that differs."""
-    old_idx, new_idx = build_index(old), build_index(new)
-    return {
-        i: new_idx[i]
-        for i in old_idx
-        if i in new_idx
-        and not isinstance(old_idx[i], (dict, list))
-        and old_idx[i] != new_idx[i]
-    }
+    """Return [(index, new_value), ...] for every leaf that differs.
+
+    Walks old and new together in a single pass, numbering entities the same
+    way as build_index. Where the two sides stop lining up (different
+    container types, keys or lengths) the whole container is replaced at its
+    own index instead of descending further; subtrees that compare equal are
+    skipped outright. Pairs come out in walk order, i.e. by ascending index.
+    """
+    updates = []
+    counter = [0]
+
+    def _walk(old_obj, new_obj):
+        idx = counter[0]
+        counter[0] += 1
+
+        if isinstance(old_obj, (dict, list)) and (
+                old_obj is new_obj
+                or (old_obj == new_obj and _strict_equal(old_obj, new_obj))):
+            # Unchanged subtree (often the very same object, since
+            # apply_updates shares untouched branches): skip without descending
+            counter[0] += count_indices(old_obj) - 1
+            return
+
+        if isinstance(old_obj, dict):
+            if isinstance(new_obj, dict) and old_obj.keys() == new_obj.keys():
+                for key, value in old_obj.items():
+                    counter[0] += 2        # map entry + field name
+                    _walk(value, new_obj[key])
+                return
+        elif isinstance(old_obj, list):
+            if isinstance(new_obj, list) and len(old_obj) == len(new_obj):
+                for old_item, new_item in zip(old_obj, new_obj):
+                    _walk(old_item, new_item)
+                return
+        elif not isinstance(new_obj, (dict, list)):
+            # 1, True and 1.0 compare equal but encode differently
+            if type(old_obj) is not type(new_obj) or old_obj != new_obj:
+                updates.append((idx, new_obj))
+            return
+
+        # Structures diverge: replace at this index, skip the old subtree
+        updates.append((idx, new_obj))
+        counter[0] += count_indices(old_obj) - 1
+
+    _walk(old, new)
+    return updates
 
 
 def apply_updates(obj, updates):
-    """Apply index-keyed value replacements to a deep copy of obj."""
-    return apply_diff(obj, updates, set(), {}, {})
+    """Apply index-keyed value replacements, copying only what changes.
+
+    Containers on the path to an updated index are rebuilt; every untouched
+    subtree is shared with obj by reference, so neither obj nor the result
+    should be mutated afterwards.
+
+    Both passes stop counting once they are past the highest updated index:
+    nothing later in the walk can change, so the tail is never sized.
+
+    updates is a list of (index, value) pairs as returned by compute_updates,
+    or an {index: value} dict.
+    """
+    if not updates:
+        return obj
+    updates = dict(updates)
+    max_idx = max(updates)
+
+    # Pass 1: mark every container with an updated index somewhere below it.
+    # Stack entries are (node, indices to skip first: 2 for a map value).
+    dirty = set()
+    path = []
+    idx = 0
+    stack = [(obj, 0)]
+    while stack:
+        node, skip = stack.pop()
+        if node is _EXIT:
+            path.pop()
+            continue
+        idx += skip
+        if idx > max_idx:
+            break
+        if idx in updates:
+            dirty.update(path)
+        t = type(node)
+        if t is dict:
+            path.append(idx)
+            stack.append((_EXIT, 0))
+            stack.extend((v, 2) for v in reversed(node.values()))
+        elif t is list:
+            path.append(idx)
+            stack.append((_EXIT, 0))
+            stack.extend((item, 0) for item in reversed(node))
+        idx += 1
+
+    # Pass 2: rebuild dirty containers, splicing each child into its parent.
+    root = [None]
+    idx = 0
+    stack = [(obj, 0, root, 0)]
+    while stack:
+        node, skip, parent, slot = stack.pop()
+        idx += skip
+        if idx > max_idx:
+            parent[slot] = node
+        elif idx in updates:
+            parent[slot] = updates[idx]
+            idx += count_indices(node)
+        elif idx not in dirty:
+            parent[slot] = node
+            idx += count_indices(node)
+        elif type(node) is dict:
+            parent[slot] = new = dict.fromkeys(node)
+            stack.extend((v, 2, new, k) for k, v in reversed(node.items()))
+            idx += 1
+        else:
+            parent[slot] = new = [None] * len(node)
+            stack.extend((item, 0, new, i) for i, item in reversed(list(enumerate(node))))
+            idx += 1
+    return root[0]
 
 
 # --- Compress / decompress pipeline ---
@@ -443,13 +904,19 @@ def apply_updates(obj, updates):
 def _encode_diff(updates, deletes, inserts, prepends):
     diff = {}
     if updates:
-        diff["u"] = [[idx, sem_compress_value(val)]
-                     for idx, val in sorted(updates.items())]
+        # compute_diff records updates in walk order, so they are already
+        # sorted by index and can be delta-encoded as they come
+        deltas = []
+        prev = 0
+        for idx in updates:
+            deltas.append(idx - prev)
+            prev = idx
+        diff["u"] = [deltas, [sem_compress_value(val) for val in updates.values()]]
     if deletes:
         diff["d"] = sorted(deletes)
     if inserts:
         diff["i"] = [[idx, sem_compress(val) if not isinstance(val, list)
-                      else [cbor2.CBORTag(FIELD_TO_TAG[val[0]], None) if val[0] in FIELD_TO_TAG
+                      else [FieldNameTag(FIELD_TO_TAG[val[0]]) if val[0] in FIELD_TO_TAG
                             else val[0], sem_compress(val[1])]]
                      for idx, vals in sorted(inserts.items())
                      for val in vals]
@@ -460,13 +927,17 @@ def _encode_diff(updates, deletes, inserts, prepends):
     return diff
 
 
-def _decode_diff(diff):
+def _decode_diff(diff, version=FORMAT_VERSION):
     updates = {}
     deletes = set()
     inserts = {}
     prepends = {}
     if "u" in diff:
-        updates = {idx: sem_decompress_value(val) for idx, val in diff["u"]}
+        if version:
+            deltas, vals = diff["u"]
+            updates = dict(zip(accumulate(deltas), map(sem_decompress_value, vals)))
+        else:
+            updates = {idx: sem_decompress_value(val) for idx, val in diff["u"]}
     if "d" in diff:
         deletes = set(diff["d"])
     if "i" in diff:
@@ -483,28 +954,96 @@ def _decode_diff(diff):
     return updates, deletes, inserts, prepends
 
 
-def compress(operations):
-    """Compress a list of operations into a CBOR blob with semantic tags."""
-    entries = [sem_compress(operations[0])]
-    for i in range(1, len(operations)):
-        entries.append(_encode_diff(*compute_diff(operations[i - 1], operations[i])))
-    return _cbor_dumps(entries)
+def _write_frame(fp, obj):
+    """Write obj to fp as one frame: varint byte length, then its CBOR."""
+    data = _cbor_dumps(obj)
+    n = len(data)
+    while n >= 0x80:
+        fp.write(bytes((n & 0x7F | 0x80,)))
+        n >>= 7
+    fp.write(bytes((n,)))
+    fp.write(data)
+
+
+def _read_frames(data):
+    """Yield each frame's decoded CBOR item from a framed blob, in order."""
+    mv = memoryview(data)
+    pos = 0
+    end = len(mv)
+    while pos < end:
+        n = shift = 0
+        while True:
+            if pos >= end:
+                raise cbor2.CBORDecodeEOF("truncated frame length")
+            byte = mv[pos]
+            pos += 1
+            n |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                break
+            shift += 7
+        if pos + n > end:
+            raise cbor2.CBORDecodeEOF("truncated frame")
+        yield _cbor_loads(mv[pos:pos + n])
+        pos += n
+
+
+def compress(operations, fp=None):
+    """Compress a list of operations into a framed blob with semantic tags.
+
+    Entries are written one frame at a time as they are produced, so the
+    whole entries list is never held in memory. If fp (a binary file object)
+    is given the blob is written straight to it and None is returned;
+    otherwise the blob is returned as bytes.
+    """
+    out = io.BytesIO() if fp is None else fp
+    _write_frame(out, FORMAT_VERSION)
+    _write_frame(out, sem_compress(operations[0]))
+    for old, new in zip(operations, operations[1:]):
+        _write_frame(out, _encode_diff(*compute_diff(old, new)))
+    if fp is None:
+        return out.getvalue()
+    return None
+
+
+def decompress_iter(data):
+    """Yield the original operations from a compressed blob one at a time.
+
+    Framed blobs (version 3 on) are decoded a frame at a time, so only the
+    previous operation is held. Version 0 blobs are a single CBOR array,
+    which always starts with a byte in 0x80-0x9f; a framed blob starts with
+    the one-byte length (0x01) of its version frame.
+    """
+    version = None
+    if data and 0x80 <= data[0] <= 0x9F:
+        version = 0
+        frames = iter(_cbor_loads(data))
+    else:
+        frames = _read_frames(data)
+    try:
+        if version is None:
+            version = next(frames)
+            if version != FORMAT_VERSION:
+                raise ValueError(f"unsupported format version {version!r}")
+        op = sem_decompress(next(frames))
+    except StopIteration:
+        # A StopIteration escaping a generator becomes a RuntimeError
+        raise cbor2.CBORDecodeEOF("blob ends before its first operation") from None
+    yield op
+    for diff in frames:
+        op = apply_diff(op, *_decode_diff(diff, version))
+        yield op
 
 
 def decompress(data):
-    """Decompress a CBOR blob back to a list of original operations."""
-    entries = _cbor_loads(data)
-    operations = [sem_decompress(entries[0])]
-    for diff in entries[1:]:
-        operations.append(apply_diff(operations[-1], *_decode_diff(diff)))
-    return operations
+    """Decompress a blob back to a list of original operations."""
+    return list(decompress_iter(data))
 
 
 # --- Display ---
 
 def format_val(val):
     """Format a value for display, truncating long items."""
-    if isinstance(val, cbor2.CBORTag):
+    if isinstance(val, (cbor2.CBORTag, ValueTag)):
         inner = val.value
         if isinstance(inner, bytes):
             return f"tag({val.tag}, <{len(inner)} bytes>)"
@@ -516,9 +1055,10 @@ def format_val(val):
 
 
 if __name__ == "__main__":
-    import json
     import sys
 
+    import orjson
+
     # Test against all example files
     examples = [
         "audit_log_example_update.json",
@@ -534,20 +1074,21 @@ if __name__ == "__main__":
 
     for filename in examples:
         try:
-            with open(filename) as f:
-                records = json.load(f)
+            with open(filename, "rb") as f:
+                records = orjson.loads(f.read())
         except FileNotFoundError:
             continue
 
         operations = [r["operation"] for r in records]
-        raw_size = sum(len(dag_cbor.encode(op)) for op in operations)
+        encoded_ops = [dag_cbor.encode(op) for op in operations]
+        raw_size = sum(map(len, encoded_ops))
 
         compressed = compress(operations)
         restored = decompress(compressed)
 
-        ok = all(
-            dag_cbor.encode(orig) == dag_cbor.encode(rest)
-            for orig, rest in zip(operations, restored)
+        ok = len(restored) == len(encoded_ops) and all(
+            orig == dag_cbor.encode(rest)
+            for orig, rest in zip(encoded_ops, restored)
         )
         status = "OK" if ok else "FAIL"
 
@@ -561,3 +1102,38 @@ if __name__ == "__main__":
     if total_raw:
         print(f"\nTotal: {total_raw} -> {total_compressed} bytes "
               f"({100*(1-total_compressed/total_raw):.1f}% saved)")
+
+    failed = 0
+
+    # The checked-in blob predates framing: a version 0 CBOR array
+    try:
+        with open("audit_log_example_update.compressed.cbor", "rb") as f:
+            legacy_blob = f.read()
+        with open("audit_log_example_update.json", "rb") as f:
+            legacy_ops = [r["operation"] for r in orjson.loads(f.read())]
+    except FileNotFoundError:
+        legacy_blob = None
+    if legacy_blob is not None:
+        restored = decompress(legacy_blob)
+        ok = [dag_cbor.encode(op) for op in restored] == [
+            dag_cbor.encode(op) for op in legacy_ops]
+        if not ok:
+            failed += 1
+        print(f"Version 0 blob: {len(restored)} ops [{'OK' if ok else 'FAIL'}]")
+
+    # Values that compare equal in Python but encode differently
+    type_swaps = [
+        [{"a": 1}, {"a": True}],
+        [{"a": [1]}, {"a": [True]}],
+        [{"x": 1}, {"x": 1.0}],
+    ]
+    swap_failed = 0
+    for operations in type_swaps:
+        restored = decompress(compress(operations))
+        if [dag_cbor.encode(op) for op in restored] != [
+                dag_cbor.encode(op) for op in operations]:
+            swap_failed += 1
+            print(f"Type swap FAIL: {operations} -> {restored}")
+    print(f"Type swaps: {len(type_swaps) - swap_failed}/{len(type_swaps)} OK")
+    if failed or swap_failed:
+        sys.exit(1)
@@ -1,7 +1,6 @@
 #!/usr/bin/env python3
 """Export all records for DIDs that have a rotationKeys change."""
 
-import json
 import os
 import psycopg2
 from dotenv import load_dotenv
@@ -16,43 +15,67 @@ conn = psycopg2.connect(
     dbname=os.environ["PLC_DB_NAME"],
 )
 
-cur = conn.cursor(name="export_cursor")
-cur.itersize = 10000
-cur.execute("""
-    SELECT e.did, e.cid, e.operation, e.nullified, e.plc_timestamp
-    FROM plc_log_entries e
-    JOIN (
-        SELECT DISTINCT cur.did
-        FROM plc_log_entries cur
-        JOIN plc_log_entries prev ON prev.cid = cur.operation->>'prev'
-                                 AND prev.did = cur.did
-        WHERE cur.nullified = false
-          AND prev.nullified = false
-          AND cur.operation->'rotationKeys' IS DISTINCT FROM prev.operation->'rotationKeys'
-    ) changed ON changed.did = e.did
-    ORDER BY e.did, e.plc_timestamp ASC
-""")
+# Postgres builds each record's JSON itself and streams it out one per line.
+# CSV with quote and delimiter characters that never occur in JSON text (it
+# escapes all control characters) passes the JSON through unquoted.
+COPY_SQL = """
+    COPY (
+        SELECT json_build_object(
+            'did', e.did,
+            'cid', e.cid,
+            'operation', e.operation,
+            'nullified', e.nullified,
+            'createdAt', e.plc_timestamp
+        )
+        FROM plc_log_entries e
+        JOIN (
+            SELECT DISTINCT cur.did
+            FROM plc_log_entries cur
+            JOIN plc_log_entries prev ON prev.cid = cur.operation->>'prev'
+                                     AND prev.did = cur.did
+            WHERE cur.nullified = false
+              AND prev.nullified = false
+              AND cur.operation->'rotationKeys' IS DISTINCT FROM prev.operation->'rotationKeys'
+        ) changed ON changed.did = e.did
+        ORDER BY e.did, e.plc_timestamp ASC
+    ) TO STDOUT WITH (FORMAT csv, QUOTE e'\\x01', DELIMITER e'\\x02')
+"""
+
+
+class JsonArrayWriter:
+    """copy_expert target that writes COPY's rows as JSON array elements.
+
+    Rows are joined with ",\\n", so the file keeps one record per line as the
+    line-based readers expect; the caller writes the enclosing brackets.
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.count = 0
+        self.row_ended = False
+
+    def write(self, data):
+        for i, part in enumerate(data.split(b"\n")):
+            if i:
+                self.row_ended = True
+                self.count += 1
+                if self.count % 100000 == 0:
+                    print(f"  exported {self.count} records...")
+            if part:
+                if self.row_ended:
+                    self.f.write(b",\n")
+                    self.row_ended = False
+                self.f.write(part)
+
 
 outfile = "rotation_key_changes.json"
-count = 0
-with open(outfile, "w") as f:
-    f.write("[\n")
-    first = True
-    for did, cid, operation, nullified, plc_timestamp in cur:
-        if not first:
-            f.write(",\n")
-        json.dump({
-            "did": did,
-            "cid": cid,
-            "operation": operation,
-            "nullified": nullified,
-            "createdAt": plc_timestamp,
-        }, f)
-        first = False
-        count += 1
-        if count % 100000 == 0:
-            print(f"  exported {count} records...")
-    f.write("\n]\n")
+cur = conn.cursor()
+with open(outfile, "wb") as f:
+    f.write(b"[\n")
+    writer = JsonArrayWriter(f)
+    cur.copy_expert(COPY_SQL, writer)
+    f.write(b"\n]\n")
+count = writer.count
 
 cur.close()
 conn.close()
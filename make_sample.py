@@ -13,63 +13,50 @@ Writes:
   rotation_key_changes_normal_sample.json
 """
 
-import hashlib
 import json
 
+import ijson
+import xxhash
+
 SAMPLE_RATE = 100  # 1 in 100 DIDs
 
 
-def should_sample(did):
-    h = int(hashlib.sha256(did.encode()).hexdigest(), 16)
-    return h % SAMPLE_RATE == 0
+def should_sample(did_bytes):
+    # Only needs to be deterministic and well mixed, not cryptographic.
+    return xxhash.xxh64_intdigest(did_bytes) % SAMPLE_RATE == 0
 
 
 def make_sample(input_path, output_path):
     current_did = None
-    current_ops = []
+    sampling = False
     sampled_dids = 0
     sampled_ops = 0
     total_dids = 0
 
-    with open(input_path) as fin, open(output_path, "w") as fout:
-        fout.write("[\n")
+    # Records are streamed straight out of the top-level array and written as
+    # soon as their DID's sampling decision is known, one record per line.
+    with open(input_path, "rb") as fin, open(output_path, "wb") as fout:
+        fout.write(b"[\n")
         first = True
 
-        for line in fin:
-            line = line.strip().rstrip(",")
-            if line in ("", "[", "]"):
-                continue
-            rec = json.loads(line)
+        for rec in ijson.items(fin, "item", use_float=True):
             did = rec["did"]
 
             if did != current_did:
-                if current_ops:
-                    total_dids += 1
-                    if should_sample(current_did):
-                        for op in current_ops:
-                            if not first:
-                                fout.write(",\n")
-                            json.dump(op, fout)
-                            first = False
-                        sampled_dids += 1
-                        sampled_ops += len(current_ops)
+                total_dids += 1
+                sampling = should_sample(did.encode("ascii"))   # DIDs are ASCII
+                if sampling:
+                    sampled_dids += 1
                 current_did = did
-                current_ops = []
-
-            current_ops.append(rec)
-
-        if current_ops:
-            total_dids += 1
-            if should_sample(current_did):
-                for op in current_ops:
-                    if not first:
-                        fout.write(",\n")
-                    json.dump(op, fout)
-                    first = False
-                sampled_dids += 1
-                sampled_ops += len(current_ops)
-
-        fout.write("\n]\n")
+
+            if sampling:
+                if not first:
+                    fout.write(b",\n")
+                fout.write(json.dumps(rec, separators=(",", ":")).encode())
+                first = False
+                sampled_ops += 1
+
+        fout.write(b"\n]\n")
 
     print(f"{output_path}: {sampled_dids} DIDs, {sampled_ops} ops "
           f"({sampled_dids/total_dids*100:.1f}% of {total_dids} DIDs)")
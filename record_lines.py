@@ -0,0 +1,18 @@
+"""Line-level reader for the rotation_key_changes*.json datasets.
+
+The exporters write one record per line inside a top-level JSON array, so
+each record can be taken from its own line without a streaming JSON parser.
+"""
+
+# Array brackets and blank lines carry no record
+SKIP_LINES = frozenset((b"", b"[", b"]"))
+
+
+def record_lines(path):
+    """Yield each record's JSON text as bytes, without its trailing comma."""
+    with open(path, "rb", buffering=1 << 20) as f:
+        for line in f:
+            line = line.rstrip(b" ,\r\n")
+            if line in SKIP_LINES:
+                continue
+            yield line
@@ -10,70 +10,153 @@ The size distribution has a clean bimodal split with zero DIDs between
 Outputs:
   rotation_key_changes_normal.json
   rotation_key_changes_abnormal.json
+  abnormal_dids.txt
+
+abnormal_dids.txt lists the abnormal DIDs, one per line, after a header line
+recording THRESHOLD and the input's size and mtime. If it exists and its
+header still matches, it is used instead of encoding the operations, so
+re-splitting the dataset skips the CBOR size check entirely; otherwise it is
+ignored and rebuilt.
+
+Records are copied to the outputs as the original line bytes; a line is only
+parsed when its operation's size has to be checked.
 """
 
 import json
-import dag_cbor
+import os
+import re
+from itertools import groupby
+
+import orjson
+
+try:
+    from libipld import encode_dag_cbor   # Rust DAG-CBOR encoder
+    NATIVE_CBOR = True
+except ImportError:
+    from dag_cbor import encode as encode_dag_cbor
+    NATIVE_CBOR = False
+
+from record_lines import record_lines
 
 THRESHOLD = 1500  # bytes; natural gap is 1099-3400, so any value there works
+INPUT_PATH = "rotation_key_changes.json"
+ABNORMAL_DIDS_PATH = "abnormal_dids.txt"
+WRITE_BUFFER_BYTES = 16 * 1024 * 1024  # per output; written out once exceeded
+
+# The exporter writes "did" as each record's first key
+DID_RE = re.compile(rb'"did"\s*:\s*"([^"]*)"')
+
+
+def record_did(line):
+    """The did of a record line, as bytes."""
+    return DID_RE.search(line).group(1)
+
+
+def cbor_size_lower_bound(op):
+    """A lower bound on the size of op's dag_cbor encoding, in bytes.
+
+    Counts only the strings in the fields that grow in abnormal ops. A CBOR
+    text string takes at least 1 header byte plus one byte per character,
+    so the sum can never overshoot the real size.
+    """
+    size = 0
+    for field in ("rotationKeys", "alsoKnownAs"):
+        items = op.get(field)
+        if type(items) is list:
+            for item in items:
+                if type(item) is str:
+                    size += 1 + len(item)
+    methods = op.get("verificationMethods")
+    if type(methods) is dict:
+        for name, key in methods.items():
+            size += 1 + len(name)
+            if type(key) is str:
+                size += 1 + len(key)
+    return size
+
+
+def is_oversized(op):
+    """True if op is more than THRESHOLD bytes when dag_cbor encoded."""
+    # Ops whose keys and handles alone pass THRESHOLD need no encoding.
+    if cbor_size_lower_bound(op) > THRESHOLD:
+        return True
+    # Compact JSON is never shorter than DAG-CBOR for PLC ops (strings, ints,
+    # bools, null, maps and arrays; no floats), so an op that fits as JSON
+    # fits as CBOR. The C json encoder is ~10x faster than pure-Python
+    # dag_cbor, so the pure-Python encoder only sees the borderline ops;
+    # libipld is faster than either and needs no pre-check.
+    if not NATIVE_CBOR and len(json.dumps(op, separators=(",", ":"))) <= THRESHOLD:
+        return False
+    return len(encode_dag_cbor(op)) > THRESHOLD
+
 
-current_did = None
-current_ops = []
 normal_count = 0
 abnormal_count = 0
+norm_buf = bytearray()
+abnorm_buf = bytearray()
+
+# Classification from an earlier run of the same THRESHOLD on the same
+# input, or None to classify by size
+st = os.stat(INPUT_PATH)
+sidecar_header = (f"# threshold={THRESHOLD} size={st.st_size} "
+                  f"mtime_ns={st.st_mtime_ns}\n")
+known_abnormal = None
+if os.path.exists(ABNORMAL_DIDS_PATH):
+    with open(ABNORMAL_DIDS_PATH) as f:
+        if f.readline() == sidecar_header:
+            known_abnormal = frozenset(line.rstrip("\n") for line in f)
+        else:
+            print(f"{ABNORMAL_DIDS_PATH} is stale, rebuilding it")
+abnormal_dids = []
 
-with open("rotation_key_changes.json") as fin, \
-     open("rotation_key_changes_normal.json", "w") as fnorm, \
-     open("rotation_key_changes_abnormal.json", "w") as fabnorm:
+with open("rotation_key_changes_normal.json", "wb") as fnorm, \
+     open("rotation_key_changes_abnormal.json", "wb") as fabnorm:
 
-    fnorm.write("[\n")
-    fabnorm.write("[\n")
-    first_norm = True
-    first_abnorm = True
+    fnorm.write(b"[\n")
+    fabnorm.write(b"[\n")
 
-    def flush(did, ops):
-        global normal_count, abnormal_count, first_norm, first_abnorm
-        is_abnormal = any(
-            len(dag_cbor.encode(r["operation"])) > THRESHOLD for r in ops
-        )
+    def flush(did, lines):
+        global normal_count, abnormal_count
+        if known_abnormal is not None:
+            is_abnormal = did in known_abnormal
+        else:
+            # Each op is encoded at most once, and only until the first
+            # oversized one; the write below copies lines without encoding.
+            is_abnormal = any(is_oversized(orjson.loads(line)["operation"])
+                              for line in lines)
         f = fabnorm if is_abnormal else fnorm
-        first_flag = "first_abnorm" if is_abnormal else "first_norm"
-
-        for rec in ops:
-            if is_abnormal:
-                if not first_abnorm:
-                    fabnorm.write(",\n")
-                json.dump(rec, fabnorm)
-                first_abnorm = False
-            else:
-                if not first_norm:
-                    fnorm.write(",\n")
-                json.dump(rec, fnorm)
-                first_norm = False
+        buf = abnorm_buf if is_abnormal else norm_buf
+        written = abnormal_count if is_abnormal else normal_count
+
+        # One record per line; every DID already written left a record
+        if written:
+            buf += b",\n"
+        buf += b",\n".join(lines)
+        if len(buf) > WRITE_BUFFER_BYTES:
+            f.write(buf)
+            buf.clear()
 
         if is_abnormal:
+            abnormal_dids.append(did)
             abnormal_count += 1
         else:
             normal_count += 1
 
-    for line in fin:
-        line = line.strip().rstrip(",")
-        if line in ("", "[", "]"):
-            continue
-        rec = json.loads(line)
-        did = rec["did"]
-        if did != current_did:
-            if current_ops:
-                flush(current_did, current_ops)
-            current_did = did
-            current_ops = []
-        current_ops.append(rec)
-
-    if current_ops:
-        flush(current_did, current_ops)
-
-    fnorm.write("\n]\n")
-    fabnorm.write("\n]\n")
+    # Records for a DID are consecutive in the export. DIDs are not interned:
+    # each line's DID is a fresh object, so sys.intern would hash every one
+    # to save a short memcmp, and a group's lines are dropped once written.
+    for did, group in groupby(record_lines(INPUT_PATH), key=record_did):
+        flush(did.decode("ascii"), list(group))   # DIDs are ASCII
+
+    fnorm.write(norm_buf)
+    fabnorm.write(abnorm_buf)
+    fnorm.write(b"\n]\n")
+    fabnorm.write(b"\n]\n")
+
+if known_abnormal is None:
+    with open(ABNORMAL_DIDS_PATH, "w") as f:
+        f.write(sidecar_header)
+        f.writelines(did + "\n" for did in sorted(abnormal_dids))
 
 total = normal_count + abnormal_count
 print(f"Normal:   {normal_count:6d} DIDs ({normal_count/total*100:.1f}%)")